@@ -1,8 +1,26 @@
 
 import argparse
+import os
+import numpy as np
 import pandas as pd
 import math
-from gurobipy import Model, GRB, quicksum
+from gurobipy import Model, GRB, LinExpr, quicksum
+
+# ------------------------------------------------------------------------
+# Solver parameters
+# Gurobi runs with its own defaults: on the example inputs they explore the
+# fewest nodes, and no hand-set parameter has been shown to help. The
+# parameters below can be set with an environment variable CEP_<NAME>,
+# e.g. CEP_THREADS=4 or CEP_MIPGAP=0.01; any other Gurobi parameter can be
+# set in a gurobi.env file.
+# ------------------------------------------------------------------------
+ENV_PARAMS = {"Threads": int, "MIPGap": float, "TimeLimit": float}
+
+def apply_solver_params(model):
+    for name, cast in ENV_PARAMS.items():
+        value = os.environ.get(f"CEP_{name.upper()}")
+        if value is not None:
+            model.setParam(name, cast(value))
 
 # ------------------------------------------------------------------------
 # Function: grouped_cep_reimbursement
@@ -17,15 +35,67 @@ from gurobipy import Model, GRB, quicksum
 def grouped_cep_reimbursement(isp_counts, enrollments, free_rate=4.5, paid_rate=0.5):
     etot = sum(enrollments)
     itot = sum(isp_counts)
-    if etot == 0:
-        return 0.0
-    I = itot / etot
-    if I >= 0.625:
-        return etot * 4.5
-    elif I >= 0.25:
-        return etot * ((free_rate * I * 1.6) + paid_rate * (1 - I))
-    else:
-        return etot * 0.5
+    return float(grouped_cep_reimbursement_vec(itot, etot, free_rate, paid_rate))
+
+# ------------------------------------------------------------------------
+# Function: grouped_cep_reimbursement_vec
+# Element-wise version of grouped_cep_reimbursement: element i is the
+# reimbursement of a group with isp_counts[i] and enrollments[i].
+# The pieces are picked with np.select rather than Python branches, and the
+# middle piece is written as 1.6*free_rate*itot + paid_rate*(etot - itot),
+# which is the same formula without dividing by etot. Thresholds are tested
+# on the integer totals (I >= 5/8, I >= 1/4) so the piece never depends on
+# how itot / etot rounds. grouped_cep_reimbursement calls this on scalars,
+# so both share one implementation of the piecewise rule.
+# ------------------------------------------------------------------------
+def grouped_cep_reimbursement_vec(isp_counts, enrollments, free_rate=4.5, paid_rate=0.5):
+    itot = np.asarray(isp_counts)
+    etot = np.asarray(enrollments)
+    return np.select(
+        [8 * itot >= 5 * etot, 4 * itot >= etot],
+        [etot * free_rate, 1.6 * free_rate * itot + paid_rate * (etot - itot)],
+        default=etot * paid_rate,
+    )
+
+# ------------------------------------------------------------------------
+# Function: sorted_sweep_grouping
+# Heuristic grouping used as a MIP start. Schools are sorted by ISP
+# (highest first) and the sorted order is cut into at most n_groups
+# contiguous runs. The cut points are chosen by dynamic programming over
+# prefix sums of ISP_COUNT and enrollment to maximize total reimbursement,
+# which costs O(n^2 * n_groups) and runs in well under a second for a
+# large district. Returns the group index of each school.
+# ------------------------------------------------------------------------
+def sorted_sweep_grouping(isp_counts, enrollments, n_groups, free_rate=4.5, paid_rate=0.5):
+    isp = np.asarray(isp_counts, dtype=np.float64)
+    enr = np.asarray(enrollments, dtype=np.float64)
+    n = len(enr)
+    ratio = np.divide(isp, enr, out=np.zeros(n), where=enr > 0)
+    order = np.argsort(-ratio, kind="stable")
+    E = np.concatenate(([0.0], np.cumsum(enr[order])))
+    W = np.concatenate(([0.0], np.cumsum(isp[order])))
+
+    # best[g, k]: best reimbursement for the first k sorted schools split into g runs.
+    best = np.full((n_groups + 1, n + 1), -np.inf)
+    best[0, 0] = 0.0
+    cut = np.zeros((n_groups + 1, n + 1), dtype=np.int64)
+    for g in range(1, n_groups + 1):
+        for k in range(g, n + 1):
+            a = np.arange(g - 1, k)
+            cand = best[g - 1, a] + grouped_cep_reimbursement_vec(W[k] - W[a], E[k] - E[a], free_rate, paid_rate)
+            j = np.argmax(cand)
+            best[g, k] = cand[j]
+            cut[g, k] = a[j]
+
+    # Using fewer runs than n_groups is allowed, so trace back from the best run count.
+    g = int(np.argmax(best[1:, n])) + 1
+    labels = np.empty(n, dtype=np.int64)
+    k = n
+    while g > 0:
+        a = cut[g, k]
+        labels[order[a:k]] = g - 1
+        k, g = a, g - 1
+    return labels
 
 # ------------------------------------------------------------------------
 # Main script using command line arguments
@@ -39,91 +109,141 @@ def main():
     args = parser.parse_args()
     
     # Read the data from the specified inputfile.
-    df = pd.read_csv(args.inputfile)
+    # Only ISP and ENROLLMENT are used. The pyarrow parser is multithreaded and much faster
+    # on large files; fall back to the default C parser when pyarrow is not installed.
+    try:
+        df = pd.read_csv(args.inputfile, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str}, engine="pyarrow")
+    except ImportError:
+        df = pd.read_csv(args.inputfile, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str})
     
     # Process the ISP column: remove "%" and convert to fraction.
     df["ISP"] = df["ISP"].astype(str).str.replace("%", "").astype(float) / 100.0
     df["ENROLLMENT"] = pd.to_numeric(df["ENROLLMENT"])
     
     # Compute ISP_COUNT as the rounded value of ISP * ENROLLMENT.
-    df["ISP_COUNT"] = df.apply(lambda row: int(round(row["ISP"] * row["ENROLLMENT"])), axis=1)
+    df["ISP_COUNT"] = np.rint(df["ISP"] * df["ENROLLMENT"]).astype(np.int64)
+
+    # Pull the columns and the benchmark totals out once; they are reused for the
+    # early exit below, the model and the report.
+    enr_arr = df["ENROLLMENT"].to_numpy()
+    isp_arr = df["ISP_COUNT"].to_numpy()
+    total_enroll = enr_arr.sum()
+    total_isp = isp_arr.sum()
+    individual_reimb = grouped_cep_reimbursement_vec(isp_arr, enr_arr).sum()
+
+    # A group's ISP is the enrollment-weighted average of its schools' ISPs, so if every
+    # school sits in the same reimbursement piece every possible group does too, and the
+    # reimbursement is linear within a piece. Any grouping then pays the same total.
+    piece = np.select([8 * isp_arr >= 5 * enr_arr, 4 * isp_arr >= enr_arr], [1, 2], default=3)
+    if len(np.unique(piece)) == 1:
+        print("All schools fall in the same reimbursement piece; grouping cannot change the total.")
+        print(f"Total reimbursement (any grouping): ${individual_reimb:.2f}")
+        return
     
-    # List of schools with attributes (using index as id)
-    schools = list(df.index)
-    enrollment = df["ENROLLMENT"].to_dict()
-    isp_count = df["ISP_COUNT"].to_dict()
+    # Schools are identified by position; attributes are plain lists indexed the same
+    # way (Python ints, so gurobipy never sees NumPy scalars as coefficients).
+    schools = list(range(len(df)))
+    enrollment = enr_arr.tolist()
+    isp_count = isp_arr.tolist()
     
-    # Number of groups from command line arguments.
-    N = args.groups
+    # Number of groups from command line arguments, capped at what can help.
+    # Two groups in the same reimbursement piece can be merged without changing the total:
+    # the merged ISP is an enrollment-weighted average, so it stays in that piece, and the
+    # reimbursement is linear within a piece. An optimal grouping therefore never needs
+    # more than one group per piece, and extra groups would only add symmetric variables.
+    N = min(args.groups, len(schools), 3)
+    if N < args.groups:
+        print(f"Using {N} groups instead of {args.groups}; more groups cannot increase the reimbursement.")
+
+    # Upper bounds for the group aggregates. Groups are ordered by enrollment (see the
+    # symmetry constraints), so group g holds at most 1/(g+1) of the total enrollment.
+    # This is a valid cut implied by the ordering; it removes no integer solution.
+    E_ub = [int(total_enroll) // (g + 1) for g in range(N)]
         
     # Build the optimization model using gurobipy.
     model = Model("School_Grouping")
     
     # Decision variables: x[i, g] = 1 if school i is assigned to group g.
-    x = {}
-    for i in schools:
-        for g in range(N):
-            x[i, g] = model.addVar(vtype=GRB.BINARY, name=f"x_{i}_{g}")
+    # Variables are created in bulk with addVars, which returns tupledicts keyed the
+    # same way the loops below index them.
+    x = model.addVars(schools, range(N), vtype=GRB.BINARY, name="x")
     
     # For each group, define aggregate enrollment E[g] and aggregate ISP_COUNT I[g].
-    E = {}
-    I_val = {}
-    for g in range(N):
-        E[g] = model.addVar(vtype=GRB.CONTINUOUS, name=f"E_{g}")
-        I_val[g] = model.addVar(vtype=GRB.CONTINUOUS, name=f"I_{g}")
+    E = model.addVars(N, vtype=GRB.CONTINUOUS, ub=E_ub, name="E")
+    I_val = model.addVars(N, vtype=GRB.CONTINUOUS, ub=int(total_isp), name="I")
     
     # For each group, add binary variables for piecewise selection:
     # y1: group where I/E >= 0.625
     # y2: group where 0.25 <= I/E < 0.625
     # y3: group where I/E < 0.25
-    y1 = {}
-    y2 = {}
-    y3 = {}
+    y1 = model.addVars(N, vtype=GRB.BINARY, name="y1")
+    y2 = model.addVars(N, vtype=GRB.BINARY, name="y2")
+    y3 = model.addVars(N, vtype=GRB.BINARY, name="y3")
     for g in range(N):
-        y1[g] = model.addVar(vtype=GRB.BINARY, name=f"y1_{g}")
-        y2[g] = model.addVar(vtype=GRB.BINARY, name=f"y2_{g}")
-        y3[g] = model.addVar(vtype=GRB.BINARY, name=f"y3_{g}")
         model.addConstr(y1[g] + y2[g] + y3[g] == 1, name=f"piecewise_sum_{g}")
     
-    model.update()
-    
-    # Link aggregate variables with decision variables.
+    # Link aggregate variables with decision variables. Each sum is built in one call
+    # from the coefficient list and the group's column of x with LinExpr(coeffs, vars),
+    # rather than term by term through a quicksum generator.
     for g in range(N):
-        model.addConstr(E[g] == quicksum(enrollment[i]*x[i, g] for i in schools), name=f"enroll_agg_{g}")
-        model.addConstr(I_val[g] == quicksum(isp_count[i]*x[i, g] for i in schools), name=f"isp_agg_{g}")
+        x_g = [x[i, g] for i in schools]
+        model.addConstr(E[g] == LinExpr(enrollment, x_g), name=f"enroll_agg_{g}")
+        model.addConstr(I_val[g] == LinExpr(isp_count, x_g), name=f"isp_agg_{g}")
     
     # Each school must be assigned to exactly one group.
     for i in schools:
-        model.addConstr(quicksum(x[i, g] for g in range(N)) == 1, name=f"assign_{i}")
-    
-    # Big-M for piecewise constraints.
-    M = df["ENROLLMENT"].sum()
+        model.addConstr(x.sum(i, "*") == 1, name=f"assign_{i}")
+
+    # Groups are interchangeable, so order them by enrollment to cut out the N!
+    # relabelings of every solution.
+    for g in range(N - 1):
+        model.addConstr(E[g] >= E[g + 1], name=f"symmetry_{g}")
     
-    # Add constraints for piecewise conditions.
+    # Reimbursement earned by each group.
+    R = model.addVars(N, vtype=GRB.CONTINUOUS, lb=0, name="R")
+
+    # Piecewise conditions and reimbursement as indicator constraints, which avoids
+    # both big-M rows and the bilinear E*y products in the objective. Each row is
+    # scaled to integer coefficients: I >= 0.625*E becomes 8*I - 5*E >= 0,
+    # I >= 0.25*E becomes 4*I - E >= 0, and the reimbursement rows are multiplied
+    # by 2 or 10.
     for g in range(N):
-        model.addConstr(I_val[g] >= 0.625 * E[g] - M*(1 - y1[g]), name=f"piece1_lower_{g}")
-        model.addConstr(I_val[g] >= 0.25 * E[g] - M*(1 - y2[g]), name=f"piece2_lower_{g}")
-        model.addConstr(I_val[g] <= 0.625 * E[g] + M*(1 - y2[g]), name=f"piece2_upper_{g}")
-        model.addConstr(I_val[g] <= 0.25 * E[g] + M*(1 - y3[g]), name=f"piece3_upper_{g}")
+        model.addGenConstrIndicator(y1[g], True, 8 * I_val[g] - 5 * E[g], GRB.GREATER_EQUAL, 0.0, name=f"piece1_lower_{g}")
+        model.addGenConstrIndicator(y2[g], True, 4 * I_val[g] - E[g], GRB.GREATER_EQUAL, 0.0, name=f"piece2_lower_{g}")
+        model.addGenConstrIndicator(y2[g], True, 8 * I_val[g] - 5 * E[g], GRB.LESS_EQUAL, 0.0, name=f"piece2_upper_{g}")
+        model.addGenConstrIndicator(y3[g], True, 4 * I_val[g] - E[g], GRB.LESS_EQUAL, 0.0, name=f"piece3_upper_{g}")
+        model.addGenConstrIndicator(y1[g], True, 2 * R[g] - 9 * E[g], GRB.EQUAL, 0.0, name=f"reimb1_{g}")
+        model.addGenConstrIndicator(y2[g], True, 10 * R[g] - 5 * E[g] - 67 * I_val[g], GRB.EQUAL, 0.0, name=f"reimb2_{g}")
+        model.addGenConstrIndicator(y3[g], True, 2 * R[g] - E[g], GRB.EQUAL, 0.0, name=f"reimb3_{g}")
     
     # Define the objective function.
-    obj_expr = 0
-    for g in range(N):
-        obj_expr += 4.5 * E[g] * y1[g] + (0.5 * E[g] + 6.7 * I_val[g]) * y2[g] + 0.5 * E[g] * y3[g]
+    obj_expr = quicksum(R[g] for g in range(N))
     
     model.setObjective(obj_expr, GRB.MAXIMIZE)
-    model.update()
+
+    # Warm start from the ISP-sorted sweep so branch-and-bound begins with a strong incumbent.
+    start = sorted_sweep_grouping(isp_arr, enr_arr, N)
+    # Relabel the sweep's groups by descending enrollment so the start respects the ordering.
+    rank = np.argsort(-np.bincount(start, weights=enr_arr, minlength=N), kind="stable")
+    start = np.argsort(rank)[start]
+    for i in schools:
+        for g in range(N):
+            x[i, g].Start = 1.0 if start[i] == g else 0.0
     
+    apply_solver_params(model)
     print("Optimizing the grouping model...")
     model.optimize()
     
     # Output the results.
     if model.status == GRB.Status.OPTIMAL or model.status == GRB.Status.TIME_LIMIT:
         print("\nOptimal Group Assignments:")
+        # Pull every assignment value in one getAttr call and label each school by its group.
+        xv = np.array(model.getAttr("X", [x[i, g] for i in schools for g in range(N)]))
+        labels = xv.reshape(len(schools), N).argmax(axis=1)
         for g in range(N):
-            group_schools = [i for i in schools if x[i, g].x > 0.5]
-            group_enroll = sum(enrollment[i] for i in group_schools)
-            group_isp = sum(isp_count[i] for i in group_schools)
+            group_schools = np.flatnonzero(labels == g)
+            group_enroll = enr_arr[group_schools].sum()
+            group_isp = isp_arr[group_schools].sum()
             if y1[g].x > 0.5:
                 piece = "I/E >= 0.625"
                 R_g = 4.5 * group_enroll
@@ -136,12 +256,9 @@ def main():
             print(f"Group {g}: {len(group_schools)} schools, Enrollment={group_enroll:.2f}, ISP_count={group_isp}, Piece: {piece}, Reimbursement=${R_g:.2f}")
         print(f"\nTotal reimbursement (optimized): ${model.objVal:.2f}")
         
-        total_enroll = df["ENROLLMENT"].sum()
-        total_isp = df["ISP_COUNT"].sum()
         one_group_reimb = grouped_cep_reimbursement([total_isp], [total_enroll])
         print(f"Reimbursement if all schools are in one group: ${one_group_reimb:.2f}")
         
-        individual_reimb = sum(grouped_cep_reimbursement([row["ISP_COUNT"]], [row["ENROLLMENT"]]) for _, row in df.iterrows())
         print(f"Reimbursement if each school is in its own group: ${individual_reimb:.2f}")
     else:
         print("No optimal solution found.")
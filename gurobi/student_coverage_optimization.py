@@ -1,6 +1,30 @@
+import os
+import numpy as np
 import pandas as pd
 import math
-from gurobipy import Model, GRB, quicksum
+from gurobipy import Model, GRB
+
+# Parameters Gurobi is given on top of its own defaults. The objective is a whole number
+# of students, so the knapsack is solved to a zero gap: the default 1e-4 gap can stop a few
+# students short of the optimum on large districts, and closing it costs no measurable time.
+SOLVER_PARAMS = {"MIPGap": 0.0}
+
+# Parameters that can be overridden with an environment variable CEP_<NAME>, e.g.
+# CEP_THREADS=4 or CEP_MIPGAP=0.01, and the type each value is read as. Any other
+# Gurobi parameter can be set in a gurobi.env file.
+ENV_PARAMS = {"Threads": int, "MIPGap": float, "TimeLimit": float}
+
+def apply_solver_params(model):
+    """
+    Sets SOLVER_PARAMS on the model, then any of ENV_PARAMS given as a CEP_<NAME>
+    environment variable.
+    """
+    for name, value in SOLVER_PARAMS.items():
+        model.setParam(name, value)
+    for name, cast in ENV_PARAMS.items():
+        value = os.environ.get(f"CEP_{name.upper()}")
+        if value is not None:
+            model.setParam(name, cast(value))
 
 def read_and_prepare_data(csv_file):
     """
@@ -11,92 +35,100 @@ def read_and_prepare_data(csv_file):
       - isp_count = round(ISP * enrollment)
     Returns a DataFrame and a list of school indices.
     """
-    df = pd.read_csv(csv_file)
-    # Clean ISP: remove the "%" symbol and convert to fraction
-    def isp_to_fraction(isp_str):
-        try:
-            return float(isp_str.strip().strip("%")) / 100.0
-        except Exception:
-            return 0.0
-    df["ISP_fraction"] = df["ISP"].apply(isp_to_fraction)
+    # Only ISP and ENROLLMENT are used. The pyarrow parser is multithreaded and much faster
+    # on large files; fall back to the default C parser when pyarrow is not installed.
+    try:
+        df = pd.read_csv(csv_file, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str}, engine="pyarrow")
+    except ImportError:
+        df = pd.read_csv(csv_file, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str})
+    # Clean ISP: remove the "%" symbol and convert to fraction; unparseable values become 0.
+    isp_str = df["ISP"].astype(str).str.replace("%", "", regex=False).str.strip()
+    df["ISP_fraction"] = pd.to_numeric(isp_str, errors="coerce").fillna(0.0) / 100.0
     df["ENROLLMENT"] = pd.to_numeric(df["ENROLLMENT"], errors="coerce")
     # Compute isp_count as rounding of ISP * enrollment
-    df["isp_count"] = df.apply(lambda row: int(round(row["ISP_fraction"] * row["ENROLLMENT"])), axis=1)
+    df["isp_count"] = np.rint(df["ISP_fraction"] * df["ENROLLMENT"]).astype(np.int64)
     return df
 
-def solve_optimization(df):
+def greedy_pack(rel, enr, isp):
+    """
+    Builds a feasible qualifying group for the knapsack in solve_optimization.
+    Every school with 4*isp_count >= enrollment is taken, since it only adds enrollment
+    and slack. The remaining schools are tried in order of their relaxation value rel
+    (highest first), ties broken by enrollment gained per unit of slack used, and each
+    is kept if the group still has I >= 0.25 * E.
+    rel may be None, in which case only the enrollment-per-slack order is used.
+    Returns a 0/1 array over the schools.
     """
-    Solves the optimization problem using gurobipy:
-    - Schools are assigned to groups (max groups = number of schools)
-    - Each school must be assigned to exactly one group.
-    - For each group g:
-         Let E_g = sum(enrollment of schools in group g)
-         Let I_g = sum(isp_count of schools in group g)
-      Define binary variable y_g which is 1 if group qualifies (i.e. if I_g >= 0.25 * E_g).
-      Introduce z_g, a linearized variable representing E_g if group qualifies; otherwise 0.
-      The objective is to maximize the sum of z_g over all groups.
+    surplus = 4 * isp - enr
+    pick = surplus >= 0
+    budget = surplus[pick].sum()
+    cand = np.flatnonzero(~pick)
+    eff = enr[cand] / -surplus[cand]
+    prio = np.zeros(len(cand)) if rel is None else np.asarray(rel)[cand]
+    for s in cand[np.lexsort((-eff, -prio))]:
+        if budget + surplus[s] >= 0:
+            budget += surplus[s]
+            pick[s] = True
+    return pick.astype(np.float64)
+
+def heur_cb(model, where):
     """
-    schools = df.index.tolist()
-    n = len(schools)
-    groups = range(n)  # Maximum groups equal to number of schools
+    Gurobi callback: at MIPNODE, rounds the node relaxation with greedy_pack and
+    offers it as a solution. When to stop is left to Gurobi's own MIPGap.
+    """
+    if where == GRB.Callback.MIPNODE:
+        if model.cbGet(GRB.Callback.MIPNODE_STATUS) == GRB.OPTIMAL:
+            rel = model.cbGetNodeRel(model._x)
+            model.cbSetSolution(model._x, greedy_pack(rel, model._enr, model._isp))
+            model.cbUseSolution()
 
-    # Total enrollment sum for big-M computation
-    M = df["ENROLLMENT"].sum()
+def solve_optimization(df):
+    """
+    Solves the optimization problem using gurobipy as a set-partitioning model:
+    - A group pattern is any subset S of schools. It qualifies if
+      sum(isp_count in S) >= 0.25 * sum(enrollment in S) and is worth sum(enrollment in S).
+    - The master problem picks disjoint qualifying patterns to maximize the covered
+      enrollment; schools left over form one group that does not qualify.
+    - The union of two qualifying patterns also qualifies (its ISP is an enrollment-weighted
+      average of values >= 0.25), so the master always has an optimal solution that uses a
+      single pattern. Pricing that pattern is a 0/1 knapsack over the schools:
+         maximize   sum(enrollment[s] * x[s])
+         subject to sum((4 * isp_count[s] - enrollment[s]) * x[s]) >= 0
+      and that knapsack is solved directly: n binaries instead of n^2 assignment
+      variables, and no big-M constraints.
+    The assignment puts the qualifying pattern in group 0 and every other school in group 1.
+    """
+    # Coefficient vectors indexed by school position; the model is built from them with
+    # gurobipy's matrix API, so each row is one vector product instead of a Python loop.
+    enr = df["ENROLLMENT"].to_numpy(dtype=np.float64)
+    isp = df["isp_count"].to_numpy(dtype=np.float64)
+    n = len(enr)
 
     # Create model
     model = Model("school_grouping")
 
-    # Binary assignment variable: x[s, g] == 1 if school s is assigned to group g
-    x = {}
-    for s in schools:
-        for g in groups:
-            x[s, g] = model.addVar(vtype=GRB.BINARY, name=f"x_{s}_{g}")
-
-    # Binary indicator for each group qualifying (group ISP >= 0.25)
-    y = {}
-    for g in groups:
-        y[g] = model.addVar(vtype=GRB.BINARY, name=f"y_{g}")
-        
-    # Continuous variable z[g] representing the group enrollment if qualifies, 0 otherwise.
-    z = {}
-    for g in groups:
-        z[g] = model.addVar(vtype=GRB.CONTINUOUS, lb=0, name=f"z_{g}")
-    
-    model.update()
-
-    # Constraint: each school is assigned to exactly one group.
-    for s in schools:
-        model.addConstr(quicksum(x[s, g] for g in groups) == 1, name=f"school_assignment_{s}")
-
-    # For each group, compute group enrollment and isp_count as expressions.
-    # Then add constraints linking qualification and the z variable.
-    for g in groups:
-        # Group total enrollment E_g and total ISP count I_g.
-        E_g = quicksum(df.loc[s, "ENROLLMENT"] * x[s, g] for s in schools)
-        I_g = quicksum(df.loc[s, "isp_count"] * x[s, g] for s in schools)
-        
-        # Constraint to enforce qualification: if y[g]==1 then I_g must be at least 0.25 * E_g.
-        # Using big-M: I_g >= 0.25 * E_g - M*(1 - y[g])
-        model.addConstr(I_g >= 0.25 * E_g - M * (1 - y[g]), name=f"qualify_{g}")
-        
-        # Linearization constraints for z[g] = E_g * y[g]:
-        model.addConstr(z[g] <= E_g, name=f"z_upper1_{g}")
-        model.addConstr(z[g] <= M * y[g], name=f"z_upper2_{g}")
-        model.addConstr(z[g] >= E_g - M * (1 - y[g]), name=f"z_lower_{g}")
-    
-    # Set objective: maximize the sum of enrollment in groups that meet the ISP criteria.
-    model.setObjective(quicksum(z[g] for g in groups), GRB.MAXIMIZE)
+    # Binary pattern variables: x[s] == 1 if school s is in the qualifying group
+    x = model.addMVar(n, vtype=GRB.BINARY, name="x")
+
+    # Constraint: the qualifying group must have I >= 0.25 * E, written as 4*I - E >= 0
+    # so every coefficient is an integer.
+    model.addConstr((4 * isp - enr) @ x >= 0, name="qualify")
 
-    model.optimize()
+    # Set objective: maximize the enrollment of the qualifying group.
+    model.setObjective(enr @ x, GRB.MAXIMIZE)
 
-    # Extract solution: assignment for each school.
+    # Warm start from the greedy packing, and let the callback keep rounding node
+    # relaxations into incumbents.
+    x.Start = greedy_pack(None, enr, isp)
+    model._x, model._enr, model._isp = x, enr, isp
+    apply_solver_params(model)
+    model.optimize(heur_cb)
+
+    # Extract solution: assignment for each school, read back as one array.
     assignment = {}
-    if model.status == GRB.Status.OPTIMAL or model.status == GRB.Status.TIME_LIMIT:
-        for s in schools:
-            for g in groups:
-                if x[s, g].X > 0.5:
-                    assignment[s] = g
-                    break
+    if (model.status == GRB.Status.OPTIMAL or model.status == GRB.Status.TIME_LIMIT) and model.SolCount > 0:
+        groups = np.where(x.X > 0.5, 0, 1)
+        assignment = dict(enumerate(groups.tolist()))
 
     solution_objective = model.ObjVal if model.status == GRB.Status.OPTIMAL else None
 
@@ -113,15 +145,14 @@ def compute_comparisons(df):
     # 1. All schools in one group:
     total_enrollment = df["ENROLLMENT"].sum()
     total_isp_count = df["isp_count"].sum()
-    qualifies_one_group = (total_isp_count >= 0.25 * total_enrollment)
+    qualifies_one_group = (4 * total_isp_count >= total_enrollment)
     one_group_value = total_enrollment if qualifies_one_group else 0
 
     # 2. Each school in its own group:
     # Each school qualifies individually if its isp_count >= 0.25*enrollment.
-    individual_value = 0
-    for idx, row in df.iterrows():
-        if row["isp_count"] >= 0.25 * row["ENROLLMENT"]:
-            individual_value += row["ENROLLMENT"]
+    enr = df["ENROLLMENT"].to_numpy()
+    isp = df["isp_count"].to_numpy()
+    individual_value = enr[4 * isp >= enr].sum()
     return one_group_value, individual_value
 
 def main():
@@ -140,12 +171,17 @@ def main():
     groups = {}
     for s, grp in assignment.items():
         groups.setdefault(grp, []).append(s)
-    
+
+    # Pull the columns out once so per-group totals are NumPy gathers, not .loc lookups.
+    enr = df["ENROLLMENT"].to_numpy()
+    isp = df["isp_count"].to_numpy()
+
     for grp, schools in groups.items():
-        group_enrollment = sum(df.loc[s, "ENROLLMENT"] for s in schools)
+        idx = np.asarray(schools)
+        group_enrollment = enr[idx].sum()
         # Compute group's isp_count and check qualification: (I_g >= 0.25*E_g)
-        group_isp = sum(df.loc[s, "isp_count"] for s in schools)
-        qualifies = "Yes" if group_isp >= 0.25 * group_enrollment else "No"
+        group_isp = isp[idx].sum()
+        qualifies = "Yes" if 4 * group_isp >= group_enrollment else "No"
         print(f"Group {grp}: Schools {schools} | Enrollment: {group_enrollment} | Qualifies: {qualifies}")
 
     # Compute comparison values.
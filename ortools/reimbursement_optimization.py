@@ -1,7 +1,9 @@
 import argparse
+import os
+import numpy as np
 import pandas as pd
 import math
-from ortools.linear_solver import pywraplp
+from ortools.sat.python import cp_model
 
 def grouped_cep_reimbursement(isp_counts, enrollments, free_rate=4.5, paid_rate=0.5):
     """
@@ -11,17 +13,74 @@ def grouped_cep_reimbursement(isp_counts, enrollments, free_rate=4.5, paid_rate=
       - if 0.25 <= I/E < 0.625: reimbursement = 0.5*enrollment_total + 6.7*isp_total
       - if I/E < 0.25: reimbursement = enrollment_total * paid_rate
     """
-    etot = sum(enrollments)
-    itot = sum(isp_counts)
-    if etot == 0:
-        return 0.0
-    I_ratio = itot / etot
-    if I_ratio >= 0.625:
-        return etot * free_rate
-    elif I_ratio >= 0.25:
-        return etot * ((free_rate * I_ratio * 1.6) + paid_rate * (1 - I_ratio))
-    else:
-        return etot * paid_rate
+    return float(grouped_cep_reimbursement_vec(sum(isp_counts), sum(enrollments), free_rate, paid_rate))
+
+def grouped_cep_reimbursement_vec(isp_counts, enrollments, free_rate=4.5, paid_rate=0.5):
+    """
+    Element-wise version of grouped_cep_reimbursement for arrays of group totals.
+    Element i is the reimbursement of a group with isp_counts[i] and enrollments[i].
+    The middle piece is written as 1.6*free_rate*itot + paid_rate*(etot - itot),
+    so no division or Python branching is needed, and thresholds are tested on the
+    integer totals (I >= 5/8, I >= 1/4). Scalars work too; grouped_cep_reimbursement
+    uses this so there is one implementation of the piecewise rule.
+    """
+    itot = np.asarray(isp_counts)
+    etot = np.asarray(enrollments)
+    return np.select(
+        [8 * itot >= 5 * etot, 4 * itot >= etot],
+        [etot * free_rate, 1.6 * free_rate * itot + paid_rate * (etot - itot)],
+        default=etot * paid_rate,
+    )
+
+def sorted_sweep_grouping(isp_counts, enrollments, n_groups, free_rate=4.5, paid_rate=0.5):
+    """
+    Heuristic grouping used as a solution hint. Schools are sorted by ISP (highest
+    first) and the sorted order is cut into at most n_groups contiguous runs. The cut
+    points are chosen by dynamic programming over prefix sums of ISP_COUNT and
+    enrollment to maximize total reimbursement, in O(n^2 * n_groups).
+    Returns the group index of each school.
+    """
+    isp = np.asarray(isp_counts, dtype=np.float64)
+    enr = np.asarray(enrollments, dtype=np.float64)
+    n = len(enr)
+    ratio = np.divide(isp, enr, out=np.zeros(n), where=enr > 0)
+    order = np.argsort(-ratio, kind="stable")
+    E = np.concatenate(([0.0], np.cumsum(enr[order])))
+    W = np.concatenate(([0.0], np.cumsum(isp[order])))
+
+    # best[g, k]: best reimbursement for the first k sorted schools split into g runs.
+    best = np.full((n_groups + 1, n + 1), -np.inf)
+    best[0, 0] = 0.0
+    cut = np.zeros((n_groups + 1, n + 1), dtype=np.int64)
+    for g in range(1, n_groups + 1):
+        for k in range(g, n + 1):
+            a = np.arange(g - 1, k)
+            cand = best[g - 1, a] + grouped_cep_reimbursement_vec(W[k] - W[a], E[k] - E[a], free_rate, paid_rate)
+            j = np.argmax(cand)
+            best[g, k] = cand[j]
+            cut[g, k] = a[j]
+
+    # Using fewer runs than n_groups is allowed, so trace back from the best run count.
+    g = int(np.argmax(best[1:, n])) + 1
+    labels = np.empty(n, dtype=np.int64)
+    k = n
+    while g > 0:
+        a = cut[g, k]
+        labels[order[a:k]] = g - 1
+        k, g = a, g - 1
+    return labels
+
+def set_solver_params(solver):
+    """
+    Configures the CP-SAT solver. The number of search workers defaults to the number
+    of CPUs but at least 8, since CP-SAT only runs its full portfolio (LP-based bound
+    workers alongside LNS) with 8 or more workers, even on fewer cores. Override it with
+    the CEP_THREADS environment variable. The search runs to proven optimality unless
+    CEP_MIPGAP sets a relative gap to stop at.
+    """
+    solver.parameters.num_workers = int(os.environ.get("CEP_THREADS", max(8, os.cpu_count() or 1)))
+    if "CEP_MIPGAP" in os.environ:
+        solver.parameters.relative_gap_limit = float(os.environ["CEP_MIPGAP"])
 
 def main():
     parser = argparse.ArgumentParser(description="ORtools optimization model for grouping schools to maximize enrollment weighted reimbursement.")
@@ -32,55 +91,92 @@ def main():
     args = parser.parse_args()
     
     # Read CSV data
-    df = pd.read_csv(args.inputfile)
+    # Only ISP and ENROLLMENT are used. The pyarrow parser is multithreaded and much faster
+    # on large files; fall back to the default C parser when pyarrow is not installed.
+    try:
+        df = pd.read_csv(args.inputfile, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str}, engine="pyarrow")
+    except ImportError:
+        df = pd.read_csv(args.inputfile, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str})
     
     # Process ISP column: remove "%" and convert to fraction.
     df["ISP"] = df["ISP"].astype(str).str.replace("%", "").astype(float) / 100.0
     df["ENROLLMENT"] = pd.to_numeric(df["ENROLLMENT"])
     
     # Compute ISP_COUNT as rounded value of ISP * ENROLLMENT.
-    df["ISP_COUNT"] = df.apply(lambda row: int(round(row["ISP"] * row["ENROLLMENT"])), axis=1)
+    df["ISP_COUNT"] = np.rint(df["ISP"] * df["ENROLLMENT"]).astype(np.int64)
+
+    # Pull the columns and the benchmark totals out once; they are reused for the
+    # early exit below, the model and the report.
+    enr_arr = df["ENROLLMENT"].to_numpy()
+    isp_arr = df["ISP_COUNT"].to_numpy()
+    total_enroll = enr_arr.sum()
+    total_isp = isp_arr.sum()
+    individual_reimb = grouped_cep_reimbursement_vec(isp_arr, enr_arr).sum()
+
+    # A group's ISP is the enrollment-weighted average of its schools' ISPs, so if every
+    # school sits in the same reimbursement piece every possible group does too, and the
+    # reimbursement is linear within a piece. Any grouping then pays the same total.
+    piece = np.select([8 * isp_arr >= 5 * enr_arr, 4 * isp_arr >= enr_arr], [1, 2], default=3)
+    if len(np.unique(piece)) == 1:
+        print("All schools fall in the same reimbursement piece; grouping cannot change the total.")
+        print(f"Total reimbursement (any grouping): ${individual_reimb:.2f}")
+        return
     
-    # Prepare data dictionaries and indices.
-    schools = list(df.index)
-    enrollment = df["ENROLLMENT"].to_dict()  # integer enrollment
-    isp_count = df["ISP_COUNT"].to_dict()      # integer ISP counts
-    N = args.groups
+    # Schools are identified by position; attributes are plain lists indexed the same
+    # way (Python ints, so ORtools never sees NumPy scalars as coefficients).
+    schools = list(range(len(df)))
+    enrollment = enr_arr.tolist()  # integer enrollment
+    isp_count = isp_arr.tolist()   # integer ISP counts
+
+    # Number of groups from command line arguments, capped at what can help.
+    # Two groups in the same reimbursement piece can be merged without changing the total:
+    # the merged ISP is an enrollment-weighted average, so it stays in that piece, and the
+    # reimbursement is linear within a piece. An optimal grouping therefore never needs
+    # more than one group per piece, and extra groups would only add symmetric variables.
+    N = min(args.groups, len(schools), 3)
+    if N < args.groups:
+        print(f"Using {N} groups instead of {args.groups}; more groups cannot increase the reimbursement.")
     
-    # Big-M parameters (upper bounds)
-    M_enroll = int(df["ENROLLMENT"].sum())      # maximum enrollment per group if all schools in one group
-    M_isp = int(df["ISP_COUNT"].sum())            # maximum isp count among all groups
-
-    # Create the solver
-    solver = pywraplp.Solver.CreateSolver('CBC_MIXED_INTEGER_PROGRAMMING')
-    if not solver:
-        print("Solver not found.")
-        return
+    # Upper bounds for the aggregate variables
+    M_enroll = int(total_enroll)      # maximum enrollment per group if all schools in one group
+    M_isp = int(total_isp)            # maximum isp count among all groups
+    # Groups are ordered by enrollment (see the symmetry constraints), so group g holds
+    # at most 1/(g+1) of the total enrollment. In piece 2, 8*I <= 5*E caps its ISP count.
+    M_enroll_g = [M_enroll // (g + 1) for g in range(N)]
+    M_isp2_g = [min(M_isp, 5 * M_enroll_g[g] // 8) for g in range(N)]
+
+    # Create the CP-SAT model. Every quantity here is an integer, so the piece
+    # thresholds are written as 8*I >= 5*E and 4*I >= E, and the products E*y are
+    # tied to their binaries with enforcement literals instead of big-M rows.
+    model = cp_model.CpModel()
 
     # Decision variables:
     # x[i,g] = 1 if school i is assigned to group g.
     x = {}
     for i in schools:
         for g in range(N):
-            x[i, g] = solver.BoolVar(f"x_{i}_{g}")
+            x[i, g] = model.NewBoolVar(f"x_{i}_{g}")
     
-    # Variables for aggregate enrollment and ISP count for group g.
+    # Aggregate enrollment and ISP count for group g. These are linear expressions in x,
+    # substituted directly into the constraints below rather than separate variables
+    # tied to x by equality rows. Each is one WeightedSum over the group's column of x.
     E = {}  # enrollment sum per group (integer)
     I_val = {}  # isp sum per group (integer)
     for g in range(N):
-        E[g] = solver.NumVar(0, M_enroll, f"E_{g}")
-        I_val[g] = solver.NumVar(0, M_isp, f"I_{g}")
+        x_g = [x[i, g] for i in schools]
+        E[g] = cp_model.LinearExpr.WeightedSum(x_g, enrollment)
+        I_val[g] = cp_model.LinearExpr.WeightedSum(x_g, isp_count)
 
     # Binary variables for piecewise selection per group.
     y1, y2, y3 = {}, {}, {}
     for g in range(N):
-        y1[g] = solver.BoolVar(f"y1_{g}")  # I/E >= 0.625
-        y2[g] = solver.BoolVar(f"y2_{g}")  # 0.25 <= I/E < 0.625
-        y3[g] = solver.BoolVar(f"y3_{g}")  # I/E < 0.25
+        y1[g] = model.NewBoolVar(f"y1_{g}")  # I/E >= 0.625
+        y2[g] = model.NewBoolVar(f"y2_{g}")  # 0.25 <= I/E < 0.625
+        y3[g] = model.NewBoolVar(f"y3_{g}")  # I/E < 0.25
         # Each group must fall into exactly one piece.
-        solver.Add(y1[g] + y2[g] + y3[g] == 1)
+        model.AddExactlyOne([y1[g], y2[g], y3[g]])
     
-    # Define auxiliary variables to linearize the products E[g]*y and I_val[g]*y.
+    # Auxiliary variables for the products E[g]*y and I_val[g]*y.
     # For group g: 
     # z1[g] = E[g]*y1[g], 
     # z2E[g] = E[g]*y2[g], 
@@ -88,85 +184,84 @@ def main():
     # z3[g] = E[g]*y3[g].
     z1, z2E, z2I, z3 = {}, {}, {}, {}
     for g in range(N):
-        z1[g] = solver.NumVar(0, M_enroll, f"z1_{g}")
-        z2E[g] = solver.NumVar(0, M_enroll, f"z2E_{g}")
-        z2I[g] = solver.NumVar(0, M_isp, f"z2I_{g}")
-        z3[g] = solver.NumVar(0, M_enroll, f"z3_{g}")
-    
-    # Set a sufficiently large constant for linearization (big-M)
-    BIG = M_enroll  # for enrollment products; similarly, BIG_I for I_val will be M_isp.
-    
-    # Linearization constraints for products: z = E * y
-    for g in range(N):
-        # For z1[g] = E[g]*y1[g]
-        solver.Add(z1[g] <= M_enroll * y1[g])
-        solver.Add(z1[g] <= E[g])
-        solver.Add(z1[g] >= E[g] - M_enroll * (1 - y1[g]))
-        solver.Add(z1[g] >= 0)
-        # For z2E[g] = E[g]*y2[g]
-        solver.Add(z2E[g] <= M_enroll * y2[g])
-        solver.Add(z2E[g] <= E[g])
-        solver.Add(z2E[g] >= E[g] - M_enroll * (1 - y2[g]))
-        solver.Add(z2E[g] >= 0)
-        # For z2I[g] = I_val[g]*y2[g]
-        solver.Add(z2I[g] <= M_isp * y2[g])
-        solver.Add(z2I[g] <= I_val[g])
-        solver.Add(z2I[g] >= I_val[g] - M_isp * (1 - y2[g]))
-        solver.Add(z2I[g] >= 0)
-        # For z3[g] = E[g]*y3[g]
-        solver.Add(z3[g] <= M_enroll * y3[g])
-        solver.Add(z3[g] <= E[g])
-        solver.Add(z3[g] >= E[g] - M_enroll * (1 - y3[g]))
-        solver.Add(z3[g] >= 0)
+        z1[g] = model.NewIntVar(0, M_enroll_g[g], f"z1_{g}")
+        z2E[g] = model.NewIntVar(0, M_enroll_g[g], f"z2E_{g}")
+        z2I[g] = model.NewIntVar(0, M_isp2_g[g], f"z2I_{g}")
+        z3[g] = model.NewIntVar(0, M_enroll_g[g], f"z3_{g}")
     
-    # Link aggregate variables with decision variables.
+    # z = E * y: each z is 0 unless its piece is selected. Exactly one piece is selected,
+    # so the enrollment products are tied to E by one conservation row,
+    # z1 + z2E + z3 == E, instead of an enforced equality per product. Only z2I, the
+    # one product of I, needs its own.
     for g in range(N):
-        solver.Add(E[g] == solver.Sum(enrollment[i] * x[i, g] for i in schools))
-        solver.Add(I_val[g] == solver.Sum(isp_count[i] * x[i, g] for i in schools))
+        for z, y in ((z1[g], y1[g]), (z2E[g], y2[g]), (z2I[g], y2[g]), (z3[g], y3[g])):
+            model.Add(z == 0).OnlyEnforceIf(y.Not())
+        model.Add(z1[g] + z2E[g] + z3[g] == E[g])
+        model.Add(z2I[g] == I_val[g]).OnlyEnforceIf(y2[g])
     
     # Each school is assigned to exactly one group.
     for i in schools:
-        solver.Add(solver.Sum(x[i, g] for g in range(N)) == 1)
+        model.AddExactlyOne([x[i, g] for g in range(N)])
+
+    # Groups are interchangeable, so order them by enrollment to cut out the N!
+    # relabelings of every solution.
+    for g in range(N - 1):
+        model.Add(E[g] >= E[g + 1])
     
-    # Add piecewise constraints using big-M formulation.
-    # For y1: if selected then I_val[g] >= 0.625 * E[g].
-    for g in range(N):
-        solver.Add(I_val[g] >= 0.625 * E[g] - BIG * (1 - y1[g]))
-    # For y2: if selected then 0.25*E[g] <= I_val[g] <= 0.625*E[g].
-    for g in range(N):
-        solver.Add(I_val[g] >= 0.25 * E[g] - BIG * (1 - y2[g]))
-        solver.Add(I_val[g] <= 0.625 * E[g] + BIG * (1 - y2[g]))
-    # For y3: if selected then I_val[g] <= 0.25 * E[g].
+    # Piecewise conditions, enforced only for the selected piece.
+    # For y1: I_val[g] >= 0.625 * E[g].
+    # For y2: 0.25*E[g] <= I_val[g] <= 0.625*E[g].
+    # For y3: I_val[g] <= 0.25 * E[g].
     for g in range(N):
-        solver.Add(I_val[g] <= 0.25 * E[g] + BIG * (1 - y3[g]))
+        model.Add(8 * I_val[g] >= 5 * E[g]).OnlyEnforceIf(y1[g])
+        model.Add(4 * I_val[g] >= E[g]).OnlyEnforceIf(y2[g])
+        model.Add(8 * I_val[g] <= 5 * E[g]).OnlyEnforceIf(y2[g])
+        model.Add(4 * I_val[g] <= E[g]).OnlyEnforceIf(y3[g])
     
     # Objective: maximize total reimbursement.
     # Reimbursement per group:
     # If y1: reimbursement = free_rate * E[g] = 4.5 * E[g]
     # If y2: reimbursement = 0.5 * E[g] + 6.7 * I_val[g]
     # If y3: reimbursement = paid_rate * E[g] = 0.5 * E[g]
-    # After linearization the bilinear terms become:
+    # With the products replaced by z:
     #   for y1: 4.5 * (E[g]*y1) becomes 4.5 * z1[g]
     #   for y2: 0.5 * (E[g]*y2) becomes 0.5 * z2E[g] and 6.7 * (I_val[g]*y2) becomes 6.7 * z2I[g]
     #   for y3: 0.5 * (E[g]*y3) becomes 0.5 * z3[g]
-    objective = solver.Sum(4.5 * z1[g] + (0.5 * z2E[g] + 6.7 * z2I[g]) + 0.5 * z3[g] for g in range(N))
-    solver.Maximize(objective)
+    # The objective is multiplied by 10 so CP-SAT works with integer coefficients only;
+    # the reported total is divided back down.
+    objective = cp_model.LinearExpr.WeightedSum(
+        [v for g in range(N) for v in (z1[g], z2E[g], z2I[g], z3[g])], [45, 5, 67, 5] * N)
+    model.Maximize(objective)
+
+    # Hint the ISP-sorted sweep so the search begins from a strong solution.
+    start = sorted_sweep_grouping(isp_arr, enr_arr, N)
+    # Relabel the sweep's groups by descending enrollment so the hint respects the ordering.
+    rank = np.argsort(-np.bincount(start, weights=enr_arr, minlength=N), kind="stable")
+    start = np.argsort(rank)[start]
+    for i in schools:
+        for g in range(N):
+            model.AddHint(x[i, g], int(start[i] == g))
     
-    print("Optimizing the grouping model with ORtools...")
-    status = solver.Solve()
+    print("Optimizing the grouping model with ORtools CP-SAT...")
+    solver = cp_model.CpSolver()
+    set_solver_params(solver)
+    status = solver.Solve(model)
     
-    if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
+    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
         print("\nOptimal Group Assignments:")
-        total_obj = solver.Objective().Value()
+        total_obj = solver.ObjectiveValue() / 10
+        # Pull every assignment value in one BooleanValues call and label each school by its group.
+        xv = solver.BooleanValues(pd.Index([x[i, g] for i in schools for g in range(N)])).to_numpy()
+        labels = xv.reshape(len(schools), N).argmax(axis=1)
         for g in range(N):
             # Retrieve schools in group g.
-            group_schools = [i for i in schools if x[i, g].solution_value() > 0.5]
-            group_enroll = sum(enrollment[i] for i in group_schools)
-            group_isp = sum(isp_count[i] for i in group_schools)
-            if y1[g].solution_value() > 0.5:
+            group_schools = np.flatnonzero(labels == g)
+            group_enroll = enr_arr[group_schools].sum()
+            group_isp = isp_arr[group_schools].sum()
+            if solver.BooleanValue(y1[g]):
                 piece = "I/E >= 0.625"
                 R_g = 4.5 * group_enroll
-            elif y2[g].solution_value() > 0.5:
+            elif solver.BooleanValue(y2[g]):
                 piece = "0.25 <= I/E < 0.625"
                 R_g = 0.5 * group_enroll + 6.7 * group_isp
             else:
@@ -175,12 +270,9 @@ def main():
             print(f"Group {g}: {len(group_schools)} schools, Enrollment={group_enroll}, ISP_count={group_isp}, Piece: {piece}, Reimbursement=${R_g:.2f}")
         print(f"\nTotal reimbursement (optimized): ${total_obj:.2f}")
         
-        total_enroll = df["ENROLLMENT"].sum()
-        total_isp = df["ISP_COUNT"].sum()
         one_group_reimb = grouped_cep_reimbursement([total_isp], [total_enroll])
         print(f"Reimbursement if all schools are in one group: ${one_group_reimb:.2f}")
         
-        individual_reimb = sum(grouped_cep_reimbursement([row["ISP_COUNT"]], [row["ENROLLMENT"]]) for _, row in df.iterrows())
         print(f"Reimbursement if each school is in its own group: ${individual_reimb:.2f}")
     else:
         print("No optimal solution found.")
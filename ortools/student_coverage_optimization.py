@@ -1,5 +1,7 @@
+import os
+import numpy as np
 import pandas as pd
-from ortools.linear_solver import pywraplp
+from ortools.sat.python import cp_model
 
 def read_and_prepare_data(csv_file):
     """
@@ -10,103 +12,85 @@ def read_and_prepare_data(csv_file):
       - isp_count = round(ISP_fraction * ENROLLMENT)
     Returns a DataFrame.
     """
-    df = pd.read_csv(csv_file)
-    
-    def isp_to_fraction(isp_str):
-        try:
-            return float(isp_str.strip().strip("%")) / 100.0
-        except Exception:
-            return 0.0
-    df["ISP_fraction"] = df["ISP"].apply(isp_to_fraction)
+    # Only ISP and ENROLLMENT are used. The pyarrow parser is multithreaded and much faster
+    # on large files; fall back to the default C parser when pyarrow is not installed.
+    try:
+        df = pd.read_csv(csv_file, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str}, engine="pyarrow")
+    except ImportError:
+        df = pd.read_csv(csv_file, usecols=["ISP", "ENROLLMENT"], dtype={"ISP": str})
+    # Clean ISP: remove the "%" symbol and convert to fraction; unparseable values become 0.
+    isp_str = df["ISP"].astype(str).str.replace("%", "", regex=False).str.strip()
+    df["ISP_fraction"] = pd.to_numeric(isp_str, errors="coerce").fillna(0.0) / 100.0
     df["ENROLLMENT"] = pd.to_numeric(df["ENROLLMENT"], errors="coerce")
-    df["isp_count"] = df.apply(lambda row: int(round(row["ISP_fraction"] * row["ENROLLMENT"])), axis=1)
+    df["isp_count"] = np.rint(df["ISP_fraction"] * df["ENROLLMENT"]).astype(np.int64)
     return df
 
-def solve_optimization(df):
+def set_solver_params(solver):
     """
-    Solves the optimization problem using ORtools.
-    - Each school (row in df) is assigned to exactly one group.
-    - Maximum possible groups = number of schools.
-    For each group g:
-      Let E_g = sum(enrollment of schools in group g)
-      Let I_g = sum(isp_count of schools in group g)
-    A binary variable y[g] = 1 if the group qualifies (I_g >= 0.25 * E_g).
-    Introduce variable z[g] which equals E_g when group qualifies, linearized as:
-      z[g] <= E_g
-      z[g] <= M * y[g]
-      z[g] >= E_g - M*(1 - y[g])
-    The objective is to maximize the sum of z[g] over all groups.
+    Configures the CP-SAT solver. The number of search workers defaults to the number
+    of CPUs but at least 8, since CP-SAT only runs its full portfolio with 8 or more
+    workers; override it with the CEP_THREADS environment variable. The search runs to
+    proven optimality unless CEP_MIPGAP sets a relative gap to stop at.
     """
-    schools = df.index.tolist()
-    n = len(schools)
-    groups = list(range(n))  # Maximum groups equals the number of schools
+    solver.parameters.num_workers = int(os.environ.get("CEP_THREADS", max(8, os.cpu_count() or 1)))
+    if "CEP_MIPGAP" in os.environ:
+        solver.parameters.relative_gap_limit = float(os.environ["CEP_MIPGAP"])
 
-    # Big-M: Maximum total enrollment (cast to float to avoid type issues)
-    M = float(df["ENROLLMENT"].sum())
+def solve_optimization(df):
+    """
+    Solves the optimization problem using ORtools CP-SAT as a set-partitioning model.
+    A group pattern is any subset S of schools; it qualifies if
+    sum(isp_count in S) >= 0.25 * sum(enrollment in S) and is worth sum(enrollment in S).
+    The master problem picks disjoint qualifying patterns to maximize covered enrollment,
+    and the schools left over form one group that does not qualify.
+    The union of two qualifying patterns also qualifies (its ISP is an enrollment-weighted
+    average of values >= 0.25), so the master always has an optimal solution with a single
+    pattern, and pricing that pattern is a 0/1 knapsack:
+      maximize   sum(enrollment[s] * x[s])
+      subject to sum((4 * isp_count[s] - enrollment[s]) * x[s]) >= 0
+    (the qualification row times 4, so every coefficient is an integer as CP-SAT requires).
+    The knapsack is solved directly: n binaries, no big-M constraints.
+    The assignment puts the qualifying pattern in group 0 and every other school in group 1.
+    """
+    schools = list(range(len(df)))
+    # Pull the coefficients out once as Python lists indexed by position, so the
+    # expression builders below do list lookups instead of a df.loc call per term.
+    enr = df["ENROLLMENT"].to_numpy(dtype=np.int64).tolist()
+    isp = df["isp_count"].tolist()
 
-    # Create solver instance with CBC as the backend
-    solver = pywraplp.Solver.CreateSolver('CBC_MIXED_INTEGER_PROGRAMMING')
-    if not solver:
-        print("Solver not available.")
-        return None, None, None
+    # Create the CP-SAT model
+    model = cp_model.CpModel()
     
     # Decision variables
-    # x[s, g] = 1 if school s is assigned to group g.
+    # x[s] = 1 if school s is in the qualifying group.
     x = {}
     for s in schools:
-        for g in groups:
-            x[s, g] = solver.BoolVar(f"x_{s}_{g}")
-    
-    # y[g] = 1 if group g qualifies (I_g >= 0.25 * E_g)
-    y = {}
-    for g in groups:
-        y[g] = solver.BoolVar(f"y_{g}")
-    
-    # z[g] represents group enrollment if the group qualifies, otherwise 0.
-    z = {}
-    for g in groups:
-        z[g] = solver.NumVar(0, M, f"z_{g}")
-    
-    # Constraint: Each school must be assigned to exactly one group.
-    for s in schools:
-        solver.Add(sum(x[s, g] for g in groups) == 1)
+        x[s] = model.NewBoolVar(f"x_{s}")
     
-    # For each group, define group enrollment (E_g) and group isp_count (I_g) as expressions.
-    # Then add the qualification and linearization constraints.
-    E_expr = {}
-    I_expr = {}
-    for g in groups:
-        E_expr[g] = solver.Sum(df.loc[s, "ENROLLMENT"] * x[s, g] for s in schools)
-        I_expr[g] = solver.Sum(df.loc[s, "isp_count"] * x[s, g] for s in schools)
-        
-        # Qualification constraint: if group qualifies (y[g]=1), then I_g >= 0.25 * E_g.
-        # Using Big-M formulation: I_g >= 0.25 * E_g - M*(1-y[g])
-        solver.Add(I_expr[g] >= 0.25 * E_expr[g] - M * (1 - y[g]))
-        
-        # Linearization constraints to link z[g] = E_expr[g] * y[g]:
-        solver.Add(z[g] <= E_expr[g])
-        solver.Add(z[g] <= M * y[g])
-        solver.Add(z[g] >= E_expr[g] - M * (1 - y[g]))
+    # Qualification constraint: the qualifying group must have 4 * I >= E.
+    # Both rows are built with WeightedSum from the coefficient lists in one call.
+    x_all = [x[s] for s in schools]
+    model.Add(cp_model.LinearExpr.WeightedSum(x_all, [4 * isp[s] - enr[s] for s in schools]) >= 0)
     
-    # Objective: maximize the sum of z[g] for all groups.
-    objective = solver.Sum(z[g] for g in groups)
-    solver.Maximize(objective)
+    # Objective: maximize the enrollment of the qualifying group.
+    objective = cp_model.LinearExpr.WeightedSum(x_all, enr)
+    model.Maximize(objective)
     
-    status = solver.Solve()
+    solver = cp_model.CpSolver()
+    set_solver_params(solver)
+    status = solver.Solve(model)
     
     assignment = {}
-    if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
-        # Extract assignment: For each school, assign it to the group where x[s, g] is 1.
-        for s in schools:
-            for g in groups:
-                if x[s, g].solution_value() > 0.5:
-                    assignment[s] = g
-                    break
+    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        # Extract assignment: group 0 is the qualifying pattern, group 1 holds the rest.
+        # All values are read back in one BooleanValues call.
+        xv = solver.BooleanValues(pd.Index([x[s] for s in schools])).to_numpy()
+        assignment = dict(enumerate(np.where(xv, 0, 1).tolist()))
     else:
         print("No optimal solution found.")
         return None, None, solver
 
-    solution_objective = solver.Objective().Value()
+    solution_objective = solver.ObjectiveValue()
     return solution_objective, assignment, solver
 
 def compute_comparisons(df):
@@ -120,14 +104,13 @@ def compute_comparisons(df):
     # 1. All schools in one group.
     total_enrollment = df["ENROLLMENT"].sum()
     total_isp_count = df["isp_count"].sum()
-    qualifies_one_group = (total_isp_count >= 0.25 * total_enrollment)
+    qualifies_one_group = (4 * total_isp_count >= total_enrollment)
     one_group_value = total_enrollment if qualifies_one_group else 0
 
     # 2. Each school in its own group:
-    individual_value = 0
-    for idx, row in df.iterrows():
-        if row["isp_count"] >= 0.25 * row["ENROLLMENT"]:
-            individual_value += row["ENROLLMENT"]
+    enr = df["ENROLLMENT"].to_numpy()
+    isp = df["isp_count"].to_numpy()
+    individual_value = enr[4 * isp >= enr].sum()
     return one_group_value, individual_value
 
 def main():
@@ -147,11 +130,16 @@ def main():
     groups_assignment = {}
     for s, grp in assignment.items():
         groups_assignment.setdefault(grp, []).append(s)
-    
+
+    # Pull the columns out once so per-group totals are NumPy gathers, not .loc lookups.
+    enr = df["ENROLLMENT"].to_numpy()
+    isp = df["isp_count"].to_numpy()
+
     for grp, schools in groups_assignment.items():
-        group_enrollment = sum(df.loc[s, "ENROLLMENT"] for s in schools)
-        group_isp = sum(df.loc[s, "isp_count"] for s in schools)
-        qualifies = "Yes" if group_isp >= 0.25 * group_enrollment else "No"
+        idx = np.asarray(schools)
+        group_enrollment = enr[idx].sum()
+        group_isp = isp[idx].sum()
+        qualifies = "Yes" if 4 * group_isp >= group_enrollment else "No"
         print(f"Group {grp}: Schools {schools} | Enrollment: {group_enrollment} | Qualifies: {qualifies}")
     
     # Compute comparison benchmarks.